@@ -14,24 +14,80 @@ Design goals:
 """
 
 import os
+import errno
+import fcntl
+import hashlib
+import re
 import shutil
+import stat
 import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional, Tuple
+
 import requests
-from typing import Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------------------------------
 # CONFIG
 # ---------------------------------------------------------------------
 
 LORA_CACHE_DIR = "/workspace/cache/loras"
+LORA_SHARED_DIR = "/workspace/shared/loras"  # optional pre-seeded network volume
 DOWNLOAD_TIMEOUT = 60  # seconds
 CHUNK_SIZE = 1024 * 1024  # 1MB
 
+# In-process memo of resolved cache paths (skips stat on hot paths)
+PATH_CACHE_TTL = 300  # seconds
+
+# Segmented (multi-connection) download for large LoRAs
+SEGMENTED_MIN_BYTES = 64 * 1024 * 1024  # 64MB
+SEGMENT_COUNT = 8
+CONTENT_RANGE_RE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+# Shared HTTP connection pool (keep-alive across downloads)
+HTTP_POOL_CONNECTIONS = 16
+HTTP_POOL_MAXSIZE = 32
+
 
 # ---------------------------------------------------------------------
 # HELPERS
 # ---------------------------------------------------------------------
 
+def _build_session() -> requests.Session:
+    """
+    Build the pooled HTTP session shared by every LoRA download.
+
+    Reusing one session keeps TLS connections to Supabase Storage warm,
+    so repeated downloads skip the TCP + TLS handshake.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.2,
+            status_forcelist=[502, 503, 504],
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "Connection": "keep-alive",
+        # safetensors are already dense; skip transparent decompression
+        "Accept-Encoding": "identity",
+    })
+    return session
+
+
+_SESSION = _build_session()
+
+
 def ensure_cache_dir() -> None:
     """
     Ensure the LoRA cache directory exists.
@@ -46,12 +102,288 @@ def lora_local_path(filename: str) -> str:
     return os.path.join(LORA_CACHE_DIR, filename)
 
 
+def fadvise(fd: int, advice: str) -> None:
+    """
+    Best-effort page-cache hint; no-op where posix_fadvise is unavailable.
+    """
+    if not hasattr(os, "posix_fadvise") or not hasattr(os, advice):
+        return
+    try:
+        os.posix_fadvise(fd, 0, 0, getattr(os, advice))
+    except OSError:
+        pass
+
+
+def preallocate(fd: int, size: int) -> None:
+    """
+    Reserve contiguous extents for a download of known size (best effort).
+    """
+    if not hasattr(os, "posix_fallocate"):
+        return
+    try:
+        os.posix_fallocate(fd, 0, size)
+    except OSError:
+        pass
+
+
+def fsync_dir(path: str) -> None:
+    """
+    Flush a directory entry so a completed rename survives a crash.
+    """
+    dir_fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def etag_path(filename: str) -> str:
+    """
+    Resolve the sidecar path holding the ETag of a cached LoRA.
+    """
+    return lora_local_path(filename) + ".etag"
+
+
+def read_etag(filename: str) -> Optional[str]:
+    """
+    Return the stored ETag for a cached LoRA, if any.
+    """
+    try:
+        with open(etag_path(filename), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def write_etag(filename: str, etag: Optional[str]) -> None:
+    """
+    Persist (or clear) the ETag sidecar for a cached LoRA.
+    """
+    path = etag_path(filename)
+    if not etag:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(etag)
+
+
+def file_sha256(path: str) -> str:
+    """
+    Hex SHA-256 of a file, read back from disk in CHUNK_SIZE blocks.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
 def is_cached(filename: str) -> bool:
     """
     Check if a LoRA file already exists locally.
     """
-    path = lora_local_path(filename)
-    return os.path.isfile(path) and os.path.getsize(path) > 0
+    try:
+        st = os.stat(lora_local_path(filename))
+    except OSError:
+        return False
+    return stat.S_ISREG(st.st_mode) and st.st_size > 0
+
+
+@contextmanager
+def lora_lock(filename: str) -> Iterator[None]:
+    """
+    Hold an exclusive inter-process lock for a single LoRA filename.
+    """
+    fd = os.open(lora_local_path(filename) + ".lock", os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+
+def link_from_shared(
+    filename: str,
+    expected_size_bytes: Optional[int] = None,
+    expected_sha256: Optional[str] = None,
+) -> bool:
+    """
+    Populate the cache from LORA_SHARED_DIR without touching the network.
+
+    Hardlinks when the shared copy is on the same filesystem, otherwise
+    falls back to an in-kernel copy_file_range (reflink on XFS/btrfs).
+    A shared copy that fails the size or sha256 check is never cached.
+
+    Returns:
+        True if the LoRA is now cached, False to fall through to download.
+    """
+    shared_path = os.path.join(LORA_SHARED_DIR, filename)
+    try:
+        st = os.stat(shared_path)
+    except OSError:
+        return False
+
+    if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+        return False
+    if expected_size_bytes is not None and st.st_size != expected_size_bytes:
+        return False
+
+    final_path = lora_local_path(filename)
+    # Unique per attempt: a stale temp left by a crash may be a hardlink to the
+    # shared master copy, and must never be reopened for writing.
+    tmp_path = os.path.join(LORA_CACHE_DIR, f".tmp_{filename}_shared_{uuid.uuid4().hex}")
+
+    try:
+        try:
+            os.link(shared_path, tmp_path)
+        except OSError as e:
+            # Only a cross-device or link-refusing filesystem warrants a copy.
+            if e.errno not in (errno.EXDEV, errno.EPERM) or not hasattr(os, "copy_file_range"):
+                return False
+            src_fd = os.open(shared_path, os.O_RDONLY)
+            try:
+                dst_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                try:
+                    remaining = st.st_size
+                    while remaining > 0:
+                        copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                        if copied == 0:
+                            raise OSError(f"Short copy from shared LoRA: {shared_path}")
+                        remaining -= copied
+                    os.fsync(dst_fd)
+                finally:
+                    os.close(dst_fd)
+            finally:
+                os.close(src_fd)
+
+        if expected_sha256 is not None and file_sha256(tmp_path) != expected_sha256.lower():
+            os.remove(tmp_path)
+            return False
+
+        os.replace(tmp_path, final_path)
+        fsync_dir(LORA_CACHE_DIR)
+        return True
+
+    except OSError:
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        except Exception:
+            pass
+        return False
+
+
+def fetch_range(
+    url: str,
+    fd: int,
+    start: int,
+    end: int,
+    total_size: int,
+    if_range: Optional[str] = None,
+) -> Tuple[bool, Optional[str]]:
+    """
+    Download bytes [start, end] of url into fd at the same offset.
+
+    The response must carry Content-Range bytes start-end/total_size, so an
+    object of a different size is never stitched into a "complete" file.
+    With if_range (an ETag) a changed object answers 200 instead of 206.
+
+    Returns:
+        (False, None) if the server ignored the Range header, the object
+        size differs, or the object changed; otherwise (True, ETag).
+    """
+    headers = {"Range": f"bytes={start}-{end}"}
+    if if_range:
+        headers["If-Range"] = if_range
+
+    with _SESSION.get(
+        url,
+        headers=headers,
+        stream=True,
+        timeout=DOWNLOAD_TIMEOUT,
+    ) as response:
+        if response.status_code != 206:
+            return False, None
+
+        match = CONTENT_RANGE_RE.fullmatch(response.headers.get("Content-Range", "").strip())
+        if not match or tuple(map(int, match.groups())) != (start, end, total_size):
+            return False, None
+
+        offset = start
+        while True:
+            chunk = response.raw.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            os.pwrite(fd, chunk, offset)
+            offset += len(chunk)
+
+        if offset != end + 1:
+            raise RuntimeError(f"Short range read: bytes {start}-{end}, got {offset - start}")
+        return True, response.headers.get("ETag")
+
+
+def download_segmented(url: str, fd: int, total_size: int) -> Tuple[bool, Optional[str]]:
+    """
+    Fetch a large LoRA over SEGMENT_COUNT parallel Range requests.
+
+    The first range is fetched alone as a probe, so a server that ignores
+    Range costs one aborted response instead of SEGMENT_COUNT full bodies.
+
+    Returns:
+        (False, None) if ranges are unsupported (fd is truncated back to 0),
+        otherwise (True, ETag).
+    """
+    segment = -(-total_size // SEGMENT_COUNT)
+    ranges = [
+        (start, min(start + segment, total_size) - 1)
+        for start in range(0, total_size, segment)
+    ]
+
+    ok, etag = fetch_range(url, fd, *ranges[0], total_size)
+    # Without a strong ETag for If-Range, a mid-download replacement could
+    # mix two versions; let the caller do a single full GET instead.
+    if ok and len(ranges) > 1 and (not etag or etag.startswith("W/")):
+        ok = False
+    results = [(ok, etag)]
+    if ok and len(ranges) > 1:
+        with ThreadPoolExecutor(max_workers=len(ranges) - 1) as ex:
+            results += ex.map(
+                lambda r: fetch_range(url, fd, r[0], r[1], total_size, etag), ranges[1:]
+            )
+
+    if not all(ok for ok, _ in results):
+        os.ftruncate(fd, 0)
+        return False, None
+    return True, etag
+
+
+_PATH_CACHE: Dict[str, Tuple[str, float]] = {}
+_PATH_CACHE_LOCK = threading.Lock()
+
+
+def recall_path(filename: str) -> Optional[str]:
+    """
+    Return a recently resolved local path for this LoRA, if still fresh.
+    """
+    with _PATH_CACHE_LOCK:
+        cached = _PATH_CACHE.get(filename)
+        if cached and cached[1] > time.monotonic():
+            return cached[0]
+        _PATH_CACHE.pop(filename, None)
+    return None
+
+
+def remember_path(filename: str, path: str) -> str:
+    """
+    Record a resolved local path for PATH_CACHE_TTL seconds.
+    """
+    with _PATH_CACHE_LOCK:
+        _PATH_CACHE[filename] = (path, time.monotonic() + PATH_CACHE_TTL)
+    return path
 
 
 # ---------------------------------------------------------------------
@@ -63,6 +395,9 @@ def ensure_lora_cached(
     filename: str,
     signed_url: str,
     expected_size_bytes: Optional[int] = None,
+    expected_sha256: Optional[str] = None,
+    revalidate: bool = False,
+    cache_bypass: bool = False,
 ) -> str:
     """
     Ensure the given LoRA file exists locally.
@@ -71,6 +406,9 @@ def ensure_lora_cached(
         filename: Target filename (e.g. sf_<lora_id>.safetensors)
         signed_url: Supabase signed download URL
         expected_size_bytes: Optional safety check
+        expected_sha256: Optional hex digest verified against the bytes on disk
+        revalidate: Re-check a cached copy with If-None-Match (304 = keep)
+        cache_bypass: Skip the in-process path memo and re-check the disk
 
     Returns:
         Absolute local path to the cached LoRA file.
@@ -78,13 +416,59 @@ def ensure_lora_cached(
     Raises:
         RuntimeError if download fails or file is invalid.
     """
+    if not (revalidate or cache_bypass):
+        remembered = recall_path(filename)
+        if remembered:
+            return remembered
+
     ensure_cache_dir()
 
     final_path = lora_local_path(filename)
 
     # Fast path: already cached
-    if is_cached(filename):
-        return final_path
+    if not revalidate and is_cached(filename):
+        return remember_path(filename, final_path)
+
+    # One downloader per LoRA; concurrent workers wait, then hit the cache
+    with lora_lock(filename):
+        if is_cached(filename):
+            if not revalidate:
+                return remember_path(filename, final_path)
+        # Zero-copy path: LoRA already present on shared storage
+        elif link_from_shared(filename, expected_size_bytes, expected_sha256):
+            return remember_path(filename, final_path)
+
+        download_lora(
+            filename=filename,
+            signed_url=signed_url,
+            expected_size_bytes=expected_size_bytes,
+            expected_sha256=expected_sha256,
+        )
+
+    return remember_path(filename, final_path)
+
+
+def download_lora(
+    *,
+    filename: str,
+    signed_url: str,
+    expected_size_bytes: Optional[int] = None,
+    expected_sha256: Optional[str] = None,
+) -> str:
+    """
+    Download a LoRA into the cache via a temp file + atomic rename.
+
+    If a cached copy with a stored ETag exists, the GET is conditional and
+    a 304 keeps the cached file without transferring any bytes.
+
+    Callers should hold lora_lock(filename).
+    """
+    final_path = lora_local_path(filename)
+
+    headers = {}
+    etag = read_etag(filename) if is_cached(filename) else None
+    if etag:
+        headers["If-None-Match"] = etag
 
     # Download to a temp file first (atomic write)
     with tempfile.NamedTemporaryFile(
@@ -93,24 +477,50 @@ def ensure_lora_cached(
         delete=False,
     ) as tmp_file:
         tmp_path = tmp_file.name
+        fadvise(tmp_file.fileno(), "POSIX_FADV_SEQUENTIAL")
+        if expected_size_bytes:
+            preallocate(tmp_file.fileno(), expected_size_bytes)
 
         try:
-            with requests.get(
-                signed_url,
-                stream=True,
-                timeout=DOWNLOAD_TIMEOUT,
-            ) as response:
-                response.raise_for_status()
+            new_etag = None
+            segmented = (
+                etag is None
+                and expected_size_bytes is not None
+                and expected_size_bytes >= SEGMENTED_MIN_BYTES
+            )
+            if segmented:
+                segmented, new_etag = download_segmented(
+                    signed_url, tmp_file.fileno(), expected_size_bytes
+                )
 
-                total_written = 0
+            if not segmented:
+                with _SESSION.get(
+                    signed_url,
+                    headers=headers,
+                    stream=True,
+                    timeout=DOWNLOAD_TIMEOUT,
+                ) as response:
+                    if etag and response.status_code == 304:
+                        os.remove(tmp_path)
+                        return final_path
 
-                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
-                    if chunk:
-                        tmp_file.write(chunk)
-                        total_written += len(chunk)
+                    response.raise_for_status()
+                    new_etag = response.headers.get("ETag")
+
+                    # Stream socket -> file without materializing chunks in Python.
+                    # Honor any Content-Encoding the server applies anyway.
+                    response.raw.decode_content = True
+                    shutil.copyfileobj(response.raw, tmp_file, length=CHUNK_SIZE)
 
                 tmp_file.flush()
-                os.fsync(tmp_file.fileno())
+                # tell(), not st_size: preallocation already set the length
+                total_written = tmp_file.tell()
+            else:
+                # Every segment's Content-Range matched this total; st_size
+                # would only echo the preallocation.
+                total_written = expected_size_bytes
+
+            os.fsync(tmp_file.fileno())
 
             # Optional size validation
             if expected_size_bytes is not None:
@@ -123,8 +533,19 @@ def ensure_lora_cached(
             if total_written == 0:
                 raise RuntimeError(f"Downloaded LoRA is empty: {filename}")
 
+            # Optional read-back integrity check
+            if expected_sha256 is not None:
+                actual_sha256 = file_sha256(tmp_path)
+                if actual_sha256 != expected_sha256.lower():
+                    raise RuntimeError(
+                        f"LoRA write_corruption for {filename}: "
+                        f"expected sha256 {expected_sha256}, got {actual_sha256}"
+                    )
+
             # Atomic move into place
-            shutil.move(tmp_path, final_path)
+            os.replace(tmp_path, final_path)
+            write_etag(filename, new_etag)
+            fsync_dir(LORA_CACHE_DIR)
 
         except Exception as e:
             # Cleanup temp file on failure
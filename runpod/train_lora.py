@@ -35,13 +35,32 @@ import re
 import uuid
 import shutil
 import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
 from typing import Dict, Any, List, Tuple, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config as BotoConfig
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+
+# Faster JSON for Supabase bodies when available; stdlib otherwise.
+try:
+    import orjson  # type: ignore
+
+    json_dumps = orjson.dumps
+    json_loads = orjson.loads
+except ImportError:
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+    json_loads = json.loads
 
 # Captioning (BLIP)
 from PIL import Image
@@ -68,26 +87,32 @@ def require_env(name: str) -> str:
 # ─────────────────────────────────────────────────────────────
 # UUID hardening
 # ─────────────────────────────────────────────────────────────
-CONTROL_CHARS_RE = re.compile(r"[\x00-\x1F\x7F]")  # includes \b (\x08), \n, \r, etc.
+# str.translate deletion table: includes \b (\x08), \n, \r, etc.
+CONTROL_CHARS_TABLE = dict.fromkeys([*range(0x20), 0x7F])
 UUID_RE = re.compile(
     r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
 )
 
 
+@lru_cache(maxsize=256)
+def _canon_uuid(clean: str) -> str:
+    # The same job id is re-sanitized on every PATCH; parse it once.
+    return str(uuid.UUID(clean))
+
+
 def sanitize_uuid(raw: Any, field: str) -> str:
     if raw is None:
         raise ValueError(f"{field} is None")
 
     s = str(raw)
-    no_ctl = CONTROL_CHARS_RE.sub("", s)
+    no_ctl = s.translate(CONTROL_CHARS_TABLE)
     clean = no_ctl.strip()
 
     if clean.lower().startswith("id="):
         clean = clean[3:].strip()
 
     try:
-        u = uuid.UUID(clean)
-        out = str(u)
+        out = _canon_uuid(clean)
     except Exception:
         debug = {
             "field": field,
@@ -111,7 +136,7 @@ def sanitize_eq_filter(value: Any, field: str) -> str:
     if value is None:
         raise ValueError(f"{field} filter is None")
 
-    s = CONTROL_CHARS_RE.sub("", str(value)).strip()
+    s = str(value).translate(CONTROL_CHARS_TABLE).strip()
 
     if s.lower().startswith("eq."):
         raw_uuid = s[3:].strip()
@@ -137,12 +162,34 @@ TRAIN_SCRIPT = os.getenv("TRAIN_SCRIPT", "/workspace/sd-scripts/sdxl_train_netwo
 PYTHON_BIN = os.getenv("PYTHON_BIN", sys.executable)
 
 NETWORK_MODULE = os.getenv("LORA_NETWORK_MODULE", "networks.lora")
+# "auto" trains in bf16 on Ampere or newer (compute capability 8.0+) and fp16
+# otherwise; the T4 in start_pod.json has no bf16 tensor cores.
+MIXED_PRECISION = os.getenv("LORA_MIXED_PRECISION", "auto").strip().lower() or "auto"
 
 POLL_SECONDS = 5
 IDLE_LOG_SECONDS = 30
+# Empty-queue polls back off exponentially from POLL_SECONDS up to this cap.
+IDLE_POLL_MAX_SECONDS = int(os.getenv("LORA_IDLE_POLL_MAX_SECONDS", "30"))
+# Failed claim polls (Supabase down / 429) back off up to this, or honor Retry-After.
+ERROR_BACKOFF_MAX_SECONDS = 60
+
+# Optional Supabase Realtime wake-ups; polling stays as the safety net.
+USE_REALTIME = os.getenv("LORA_REALTIME", "0").strip() == "1"
+REALTIME_FALLBACK_POLL_SECONDS = 60
+REALTIME_HEARTBEAT_SECONDS = 25
+REALTIME_RECONNECT_SECONDS = 10
+
+# Optional direct Postgres LISTEN on the lora_queued channel (needs the
+# user_loras_queued_notify trigger migration and psycopg 3.2+).
+DATABASE_URL = os.getenv("LORA_DATABASE_URL", "").strip()
+PG_NOTIFY_CHANNEL = "lora_queued"
 
 MIN_IMAGES = 10
 MAX_IMAGES = 20
+DATASET_DOWNLOAD_WORKERS = max(1, int(os.getenv("R2_DL_CONCURRENCY", "16")))
+# get_object only retries the request; a body read that times out or is cut
+# short mid-stream is retried here with a fresh GET.
+R2_DOWNLOAD_ATTEMPTS = 3
 TARGET_SAMPLES = 1200
 
 # Old concept token default is NOT enough for identity lock; we keep it as fallback only.
@@ -159,6 +206,33 @@ CAPTION_STYLE_PREFIX = os.getenv("LORA_CAPTION_STYLE_PREFIX", "").strip()
 
 ARTIFACT_MIN_BYTES = 2 * 1024 * 1024  # 2MB
 
+# Multipart artifact upload: parallel parts instead of one long single stream.
+# LORA_S3_CRT=1 forces boto3's AWS CRT transfer client (native parallel I/O).
+# boto3 does not fall back when awscrt is missing; upload_file raises instead,
+# so sanity_checks refuses to start without it.
+ARTIFACT_UPLOAD_CONCURRENCY = 16
+USE_S3_CRT = os.getenv("LORA_S3_CRT", "0").strip() == "1"
+ARTIFACT_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=ARTIFACT_UPLOAD_CONCURRENCY,
+    use_threads=True,
+    preferred_transfer_client="crt" if USE_S3_CRT else "auto",
+)
+
+# Live training progress: parsed from the sd-scripts tqdm bar
+# ("steps:  12%|█▏   | 120/1000 [...]") and PATCHed at most this often.
+PROGRESS_UPDATE_SECONDS = 30
+TRAIN_PROGRESS_START = 2
+TRAIN_PROGRESS_END = 95
+TRAIN_HEARTBEAT_SECONDS = 300
+# The output pump runs niced (and optionally pinned to CPU 0) so it never
+# competes with the trainer's dataloader workers.
+PUMP_NICE = 10
+PIN_WORKER = os.getenv("LORA_PIN_WORKER", "0").strip() == "1"
+TRAIN_ERROR_TAIL_LINES = 20
+TRAIN_STEP_RE = re.compile(rb"steps:\s*\d+%\|[^|]*\|\s*(\d+)/(\d+)")
+
 LORA_NOTIFY_ENDPOINT = os.getenv(
     "LORA_NOTIFY_ENDPOINT",
     f"{SUPABASE_URL}/functions/v1/lora-status-notify",
@@ -168,12 +242,47 @@ HEADERS = {
     "apikey": SUPABASE_KEY,
     "Authorization": f"Bearer {SUPABASE_KEY}",
     "Content-Type": "application/json",
-    "Prefer": "return=representation",
+    # PATCH results are unused except for the claim, which asks for its row.
+    "Prefer": "return=minimal",
 }
 
 IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
 
 
+# ─────────────────────────────────────────────────────────────
+# Shared HTTP session (keep-alive + connection pooling)
+# ─────────────────────────────────────────────────────────────
+def make_http_session(retry_methods: frozenset = frozenset({"GET", "PATCH"})) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=16,
+        pool_maxsize=32,
+        # Retry transient 429/5xx in-band instead of failing the whole job.
+        # POST is left out: a lost response to the claim RPC must not claim twice.
+        # Connect failures are retried for every method (nothing was sent).
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=retry_methods,
+            raise_on_status=False,
+        ),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+SB_SESSION = make_http_session()
+SB_SESSION.headers.update(HEADERS)
+# The fallback claim is a PATCH: retrying it after the UPDATE committed (read
+# timeout, 502/504) would claim a second row and strand the first in training.
+# An empty set would mean "retry every verb" to urllib3, so list GET only.
+SB_CLAIM_SESSION = make_http_session(retry_methods=frozenset({"GET"}))
+SB_CLAIM_SESSION.headers.update(HEADERS)
+
+
 # ─────────────────────────────────────────────────────────────
 # R2 Config (S3 compatible)
 # ─────────────────────────────────────────────────────────────
@@ -207,7 +316,7 @@ R2_ARTIFACT_PREFIX_ROOT = _clean_prefix(R2_ARTIFACT_PREFIX_ROOT)
 def _clean_optional_string(value: Any) -> Optional[str]:
     if value is None:
         return None
-    cleaned = CONTROL_CHARS_RE.sub("", str(value)).strip()
+    cleaned = str(value).translate(CONTROL_CHARS_TABLE).strip()
     return cleaned or None
 
 
@@ -245,17 +354,22 @@ def resolve_dataset_source(lora_id: str, job: Dict[str, Any]) -> Tuple[str, str]
     return bucket, prefix
 
 
-def r2_enabled() -> bool:
-    return bool(
-        R2_ACCESS_KEY_ID
-        and R2_SECRET_ACCESS_KEY
-        and R2_ENDPOINT
-        and R2_ARTIFACT_BUCKET
-    )
+# Env is read once at import; the derived flag never changes afterwards.
+R2_ENABLED = bool(
+    R2_ACCESS_KEY_ID
+    and R2_SECRET_ACCESS_KEY
+    and R2_ENDPOINT
+    and R2_ARTIFACT_BUCKET
+)
 
 
+@lru_cache(maxsize=1)
 def make_r2_client():
-    if not r2_enabled():
+    """
+    One client per worker process: boto3 clients are thread-safe, and reusing
+    it keeps the warm connection pool across dataset download and upload.
+    """
+    if not R2_ENABLED:
         raise RuntimeError(
             "R2 env missing. Required: "
             "R2_ACCESS_KEY_ID, R2_SECRET_ACCESS_KEY, R2_ENDPOINT, and "
@@ -268,6 +382,11 @@ def make_r2_client():
         region_name=AWS_DEFAULT_REGION,
         retries={"max_attempts": 10, "mode": "standard"},
         signature_version="s3v4",
+        # Dataset downloads and multipart uploads fan out across threads;
+        # keep the pool wide enough for either.
+        max_pool_connections=max(DATASET_DOWNLOAD_WORKERS * 2, ARTIFACT_UPLOAD_CONCURRENCY + 4),
+        # Keep pooled R2 connections alive between the list and GET bursts.
+        tcp_keepalive=True,
     )
 
     return session.client(
@@ -294,37 +413,69 @@ def sanity_checks() -> None:
     if not CAPTION_EXTENSION.startswith("."):
         raise RuntimeError("LORA_CAPTION_EXTENSION must start with '.'")
 
-    if not r2_enabled():
+    if USE_S3_CRT:
+        from boto3.s3.transfer import has_minimum_crt_version
+
+        # Same minimum boto3 enforces before it will build the CRT client.
+        if not has_minimum_crt_version((0, 19, 18)):
+            raise RuntimeError(
+                "LORA_S3_CRT=1 but awscrt>=0.19.18 is not installed. Install: pip install boto3[crt]"
+            )
+
+    if MIXED_PRECISION not in ("auto", "fp16", "bf16"):
+        raise RuntimeError("LORA_MIXED_PRECISION must be auto, fp16 or bf16")
+
+    if not R2_ENABLED:
         raise RuntimeError("R2 is not configured. Confirm env vars exist and survived restart.")
 
+    for root, name in [
+        (LOCAL_TRAIN_ROOT, "LORA_LOCAL_TRAIN_ROOT"),
+        (OUTPUT_ROOT, "LORA_OUTPUT_ROOT"),
+    ]:
+        os.makedirs(root, exist_ok=True)
+        if not os.access(root, os.W_OK):
+            raise RuntimeError(f"{name} is not writable: {root}")
+
 
 # ─────────────────────────────────────────────────────────────
 # Supabase helpers
 # ─────────────────────────────────────────────────────────────
 def sb_get(table: str, params: Dict[str, Any]):
-    r = requests.get(
+    r = SB_SESSION.get(
         f"{SUPABASE_URL}/rest/v1/{table}",
-        headers=HEADERS,
         params=params,
         timeout=20,
     )
     r.raise_for_status()
-    return r.json() if r.text else None
+    return json_loads(r.content) if r.content else None
 
 
-def _extract_missing_column(postgrest_text: str) -> Optional[str]:
-    try:
-        j = json.loads(postgrest_text)
-        msg = (j.get("message") or "") if isinstance(j, dict) else ""
-        if "Could not find the '" in msg and "' column" in msg:
-            return msg.split("Could not find the '")[1].split("'")[0]
-        if "does not exist" in msg and "column" in msg and '"' in msg:
-            parts = msg.split('"')
-            if len(parts) >= 2:
-                return parts[1]
-    except Exception:
-        pass
-    return None
+# Matched against the raw PostgREST error body (quotes arrive JSON-escaped), so
+# other 400s cost one regex search and no JSON parse. Anchored inside the
+# "message" value so a column named in "hint" or "details" is never stripped.
+MISSING_COLUMN_RE = re.compile(
+    rb'"message":\s*"(?:'
+    rb"Could not find the '([^'\"\\]+)' column"
+    rb'|column \\"([^"\\]+)\\"(?:[^"\\]|\\.)*?does not exist'
+    rb")"
+)
+
+
+def _extract_missing_column(postgrest_body: bytes) -> Optional[str]:
+    m = MISSING_COLUMN_RE.search(postgrest_body)
+    if not m:
+        return None
+    return (m.group(1) or m.group(2)).decode("utf-8", errors="replace")
+
+
+# Columns PostgREST has rejected, per table, with the monotonic time each entry
+# expires. Skipping them saves a 400 round trip on every PATCH; the TTL makes
+# the worker re-check, so a later migration (or a PGRST204 during a schema
+# cache reload) doesn't stop it writing the column until restart.
+MISSING_COLUMN_TTL_SECONDS = 600
+_MISSING_COLUMNS: Dict[str, Dict[str, float]] = {}
+# Only these codes mean "unknown column" (PostgREST schema cache / Postgres).
+MISSING_COLUMN_CODE_RE = re.compile(rb'"code":\s*"(?:PGRST204|42703)"')
 
 
 def _sanitize_params(params: Dict[str, Any]) -> Dict[str, Any]:
@@ -333,32 +484,53 @@ def _sanitize_params(params: Dict[str, Any]) -> Dict[str, Any]:
         if k == "id":
             out[k] = sanitize_eq_filter(v, "user_loras.id")
         else:
-            out[k] = CONTROL_CHARS_RE.sub("", str(v)).strip() if v is not None else v
+            out[k] = str(v).translate(CONTROL_CHARS_TABLE).strip() if v is not None else v
     return out
 
 
-def sb_patch_safe(table: str, payload: Dict[str, Any], params: Dict[str, Any]):
-    working = dict(payload)
+def sb_patch_safe(
+    table: str,
+    payload: Dict[str, Any],
+    params: Dict[str, Any],
+    prefer: Optional[str] = None,
+    session: Optional[requests.Session] = None,
+    required: Tuple[str, ...] = ("status",),
+):
+    """
+    PATCH with unknown columns stripped. Columns in `required` are never
+    stripped: a missing one raises instead of sending a payload without it.
+    """
+    missing_cols = _MISSING_COLUMNS.setdefault(table, {})
+    now = time.monotonic()
+    working = {
+        k: v for k, v in payload.items()
+        if k in required or missing_cols.get(k, 0.0) <= now
+    }
     safe_params = _sanitize_params(params)
+    headers = {"Prefer": prefer} if prefer else None
 
-    for _ in range(12):
-        r = requests.patch(
+    # Each retry strips one column, so more attempts than keys can't help.
+    for _ in range(len(working) + 1):
+        r = (session or SB_SESSION).patch(
             f"{SUPABASE_URL}/rest/v1/{table}",
-            headers=HEADERS,
-            json=working,
+            data=json_dumps(working),
             params=safe_params,
+            headers=headers,
             timeout=20,
         )
 
         if 200 <= r.status_code < 300:
-            return r.json() if r.text else None
+            return json_loads(r.content) if r.content else None
 
         if r.status_code != 400:
             r.raise_for_status()
 
-        missing = _extract_missing_column(r.text)
-        if missing:
+        missing = _extract_missing_column(r.content)
+        if missing and MISSING_COLUMN_CODE_RE.search(r.content):
+            if missing in required:
+                raise RuntimeError(f"Supabase PATCH missing required column '{missing}'. Body: {r.text}")
             log(f"⚠️ Supabase missing column '{missing}' — stripping")
+            missing_cols[missing] = time.monotonic() + MISSING_COLUMN_TTL_SECONDS
             working.pop(missing, None)
             continue
 
@@ -367,6 +539,73 @@ def sb_patch_safe(table: str, payload: Dict[str, Any], params: Dict[str, Any]):
     raise RuntimeError("Supabase PATCH failed repeatedly (too many retries)")
 
 
+def sb_rpc(fn: str, payload: Optional[Dict[str, Any]] = None):
+    r = SB_SESSION.post(
+        f"{SUPABASE_URL}/rest/v1/rpc/{fn}",
+        data=json_dumps(payload or {}),
+        headers={"Prefer": None},
+        timeout=20,
+    )
+    r.raise_for_status()
+    return json_loads(r.content) if r.content else None
+
+
+_CLAIM_RPC_AVAILABLE = True
+
+
+def claim_next_job() -> Optional[Dict[str, Any]]:
+    """
+    Claim the oldest queued job in one round trip.
+    Prefers the claim_next_lora_job RPC (UPDATE ... FOR UPDATE SKIP LOCKED), so
+    concurrent workers each get a different row. Until that migration is
+    deployed, falls back to a conditional PATCH that only matches rows still
+    status=queued; either way an empty result means nothing was claimed.
+    Both paths clear any stale error from a previous attempt, so the job
+    needs no further writes until its terminal status.
+    """
+    global _CLAIM_RPC_AVAILABLE
+    if _CLAIM_RPC_AVAILABLE:
+        try:
+            rows = sb_rpc("claim_next_lora_job")
+            return rows[0] if rows else None
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                raise
+            log("⚠️ claim_next_lora_job RPC not found — claiming via conditional PATCH")
+            _CLAIM_RPC_AVAILABLE = False
+
+    rows = sb_patch_safe(
+        "user_loras",
+        {"status": "training", "progress": 1, "error_message": None},
+        {
+            "select": "id,user_id,status,dataset_r2_bucket,dataset_r2_prefix",
+            "status": "eq.queued",
+            "user_id": "not.is.null",
+            "order": "created_at.asc,id.asc",
+            "limit": 1,
+        },
+        prefer="return=representation",
+        session=SB_CLAIM_SESSION,
+    )
+    if rows and len(rows) > 1:
+        # PostgREST ignored limit=1 and claimed every queued row; keep one and
+        # hand the rest back rather than stranding them in training.
+        extra = [sanitize_uuid(row.get("id"), "user_loras.id") for row in rows[1:]]
+        log(
+            f"🚨 Claim PATCH ignored limit=1 and claimed {len(rows)} rows — re-queueing {len(extra)}. "
+            "Apply migration 20260808003300_claim_next_lora_job.sql."
+        )
+        try:
+            sb_patch_safe(
+                "user_loras",
+                {"status": "queued", "progress": 0},
+                {"id": f"in.({','.join(extra)})", "status": "eq.training"},
+            )
+        except Exception as e:
+            log(f"🚨 Re-queue failed; these rows are stuck in training: {', '.join(extra)} ({e})")
+    return rows[0] if rows else None
+
+
 # ─────────────────────────────────────────────────────────────
 # Edge Function notify (terminal status only)
 # ─────────────────────────────────────────────────────────────
@@ -380,10 +619,11 @@ def notify_status(job_id: str, new_status: str) -> None:
         "Authorization": f"Bearer {SUPABASE_KEY}",
         "apikey": SUPABASE_KEY,
         "Content-Type": "application/json",
+        "Prefer": None,  # drop the session's PostgREST-only header
     }
 
     try:
-        r = requests.post(LORA_NOTIFY_ENDPOINT, headers=headers, json=payload, timeout=15)
+        r = SB_SESSION.post(LORA_NOTIFY_ENDPOINT, headers=headers, json=payload, timeout=15)
         r.raise_for_status()
         log(f"📨 Notified Edge Function: status={new_status} job={job_id}")
     except Exception as e:
@@ -391,49 +631,203 @@ def notify_status(job_id: str, new_status: str) -> None:
 
 
 # ─────────────────────────────────────────────────────────────
-# R2 helpers
+# Realtime job wake-ups (optional)
 # ─────────────────────────────────────────────────────────────
-def r2_list_objects(s3, bucket: str, prefix: str) -> List[str]:
-    keys: List[str] = []
-    continuation: Optional[str] = None
+JOB_WAKE = threading.Event()
+REALTIME_CONNECTED = threading.Event()
+PG_LISTENING = threading.Event()
+
+
+def realtime_socket_url() -> str:
+    base = SUPABASE_URL.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+    return f"{base}/realtime/v1/websocket?apikey={SUPABASE_KEY}&vsn=1.0.0"
+
+
+def realtime_listen_forever() -> None:
+    """
+    Subscribe to user_loras changes with status=queued and set JOB_WAKE on each.
+    Requires user_loras in the supabase_realtime publication. The worker loop
+    still runs the normal claim; this only shortens the idle sleep.
+    """
+    try:
+        from websockets.sync.client import connect  # type: ignore
+    except Exception:
+        log("⚠️ LORA_REALTIME=1 but websockets is not installed — polling only")
+        return
+
+    join = {
+        "topic": "realtime:lora-queue",
+        "event": "phx_join",
+        "payload": {
+            "config": {
+                "postgres_changes": [
+                    {"event": "*", "schema": "public", "table": "user_loras", "filter": "status=eq.queued"}
+                ]
+            },
+            "access_token": SUPABASE_KEY,
+        },
+        "ref": "1",
+    }
 
     while True:
-        kwargs = {"Bucket": bucket, "Prefix": prefix}
-        if continuation:
-            kwargs["ContinuationToken"] = continuation
+        ref = 1
+        try:
+            with connect(realtime_socket_url(), open_timeout=15) as ws:
+                ws.send(json.dumps(join))
+                next_heartbeat = time.monotonic() + REALTIME_HEARTBEAT_SECONDS
+
+                while True:
+                    try:
+                        raw = ws.recv(timeout=max(0.0, next_heartbeat - time.monotonic()))
+                    except TimeoutError:
+                        ref += 1
+                        ws.send(json.dumps({"topic": "phoenix", "event": "heartbeat", "payload": {}, "ref": str(ref)}))
+                        next_heartbeat = time.monotonic() + REALTIME_HEARTBEAT_SECONDS
+                        continue
+
+                    msg = json.loads(raw)
+                    event = msg.get("event")
+                    payload = msg.get("payload") or {}
+
+                    if event == "phx_reply" and msg.get("ref") == "1":
+                        if payload.get("status") != "ok":
+                            raise RuntimeError(f"join rejected: {payload}")
+                        REALTIME_CONNECTED.set()
+                        log("📡 Realtime subscribed: user_loras status=queued")
+                    elif event == "postgres_changes":
+                        JOB_WAKE.set()
+                    elif event in ("phx_error", "phx_close", "system") and payload.get("status") == "error":
+                        raise RuntimeError(f"channel error: {payload}")
+        except Exception as e:
+            log(f"⚠️ Realtime disconnected ({e}) — falling back to polling")
+        finally:
+            REALTIME_CONNECTED.clear()
+
+        time.sleep(REALTIME_RECONNECT_SECONDS)
+
+
+def pg_listen_forever() -> None:
+    """
+    LISTEN on PG_NOTIFY_CHANNEL over a direct Postgres connection and set
+    JOB_WAKE on each notification. Like Realtime, it only shortens the idle
+    sleep; claims still go through claim_next_job.
+    """
+    try:
+        import psycopg  # type: ignore
+    except Exception:
+        log("⚠️ LORA_DATABASE_URL set but psycopg is not installed — polling only")
+        return
 
-        resp = s3.list_objects_v2(**kwargs)
-        for obj in resp.get("Contents", []):
+    while True:
+        try:
+            with psycopg.connect(DATABASE_URL, autocommit=True, connect_timeout=15) as conn:
+                conn.execute(f"LISTEN {PG_NOTIFY_CHANNEL}")
+                PG_LISTENING.set()
+                log(f"📡 Postgres LISTEN {PG_NOTIFY_CHANNEL}")
+                while True:
+                    for _ in conn.notifies(timeout=REALTIME_HEARTBEAT_SECONDS, stop_after=1):
+                        JOB_WAKE.set()
+                    # Quiet interval: cheap round trip so a dead socket surfaces.
+                    conn.execute("SELECT 1")
+        except Exception as e:
+            log(f"⚠️ Postgres LISTEN lost ({e}) — falling back to polling")
+        finally:
+            PG_LISTENING.clear()
+
+        time.sleep(REALTIME_RECONNECT_SECONDS)
+
+
+def claim_error_delay(err: Exception, error_polls: int) -> float:
+    resp = getattr(err, "response", None)
+    retry_after = resp.headers.get("Retry-After") if resp is not None else None
+    if retry_after:
+        try:
+            return min(max(0.0, float(retry_after)), ERROR_BACKOFF_MAX_SECONDS)
+        except ValueError:
+            pass  # HTTP-date form; fall through to exponential backoff
+    return min(POLL_SECONDS * (2 ** min(error_polls, 8)), ERROR_BACKOFF_MAX_SECONDS)
+
+
+def wait_for_jobs(idle_polls: int) -> None:
+    if REALTIME_CONNECTED.is_set() or PG_LISTENING.is_set():
+        timeout = REALTIME_FALLBACK_POLL_SECONDS
+    else:
+        timeout = min(POLL_SECONDS * (2 ** min(idle_polls, 8)), max(POLL_SECONDS, IDLE_POLL_MAX_SECONDS))
+    JOB_WAKE.wait(timeout)
+
+
+# ─────────────────────────────────────────────────────────────
+# R2 helpers
+# ─────────────────────────────────────────────────────────────
+def r2_list_objects(s3, bucket: str, prefix: str, max_images: Optional[int] = None) -> List[str]:
+    """
+    With max_images set, stop paging once the listing holds more image keys
+    than that: the dataset is already too big, so the rest can't matter.
+    """
+    keys: List[str] = []
+    images = 0
+    pages = s3.get_paginator("list_objects_v2").paginate(
+        Bucket=bucket,
+        Prefix=prefix,
+        PaginationConfig={"PageSize": 1000},
+    )
+    for page in pages:
+        for obj in page.get("Contents", ()):
             k = obj.get("Key")
             if k:
                 keys.append(k)
-
-        if resp.get("IsTruncated"):
-            continuation = resp.get("NextContinuationToken")
-            continue
-        break
-
+                images += k.lower().endswith(IMAGE_EXTS)
+        if max_images is not None and images > max_images:
+            break
     return keys
 
 
 def r2_download_file(s3, bucket: str, key: str, local_path: str) -> None:
     os.makedirs(os.path.dirname(local_path), exist_ok=True)
-    try:
-        s3.download_file(bucket, key, local_path)
-    except ClientError as e:
-        raise RuntimeError(f"R2 download failed: s3://{bucket}/{key} -> {local_path} ({e})")
-
-
-def r2_upload_artifact(s3, local_path: str, bucket: str, key: str) -> str:
-    if not os.path.exists(local_path):
-        raise RuntimeError(f"Artifact not found for upload: {local_path}")
-    size = os.path.getsize(local_path)
+    for attempt in range(1, R2_DOWNLOAD_ATTEMPTS + 1):
+        try:
+            # Small dataset images: one GET streamed to disk, no per-file
+            # TransferManager thread pool (download_file spins one up per call).
+            body = s3.get_object(Bucket=bucket, Key=key)["Body"]
+            try:
+                # Unbuffered fd writes: no BufferedWriter copy of each chunk.
+                fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+                try:
+                    while True:
+                        chunk = body.read(64 * 1024)
+                        if not chunk:
+                            break
+                        view = memoryview(chunk)
+                        while view:
+                            view = view[os.write(fd, view):]
+                finally:
+                    os.close(fd)
+            finally:
+                body.close()
+            return
+        except ClientError as e:
+            raise RuntimeError(f"R2 download failed: s3://{bucket}/{key} -> {local_path} ({e})")
+        except BotoCoreError as e:
+            if attempt == R2_DOWNLOAD_ATTEMPTS:
+                raise RuntimeError(
+                    f"R2 download failed after {attempt} attempts: s3://{bucket}/{key} -> {local_path} ({e})"
+                )
+            log(f"⚠️ R2 download interrupted ({key}), retrying {attempt}/{R2_DOWNLOAD_ATTEMPTS - 1}: {e}")
+            time.sleep(0.5 * attempt)
+
+
+def r2_upload_artifact(s3, local_path: str, bucket: str, key: str, size: Optional[int] = None) -> str:
+    if size is None:
+        try:
+            size = os.stat(local_path).st_size
+        except FileNotFoundError:
+            raise RuntimeError(f"Artifact not found for upload: {local_path}")
     if size < ARTIFACT_MIN_BYTES:
         raise RuntimeError(f"Artifact too small for upload: {size} bytes")
 
     log(f"☁️ Uploading final LoRA to R2: s3://{bucket}/{key} ({size} bytes)")
     try:
-        s3.upload_file(local_path, bucket, key)
+        s3.upload_file(local_path, bucket, key, Config=ARTIFACT_TRANSFER_CONFIG)
     except ClientError as e:
         raise RuntimeError(f"R2 upload failed: s3://{bucket}/{key} ({e})")
 
@@ -444,6 +838,36 @@ def r2_upload_artifact(s3, local_path: str, bucket: str, key: str) -> str:
 # ─────────────────────────────────────────────────────────────
 # Post-training cleanup (prevents disk quota issues)
 # ─────────────────────────────────────────────────────────────
+TRASH_MARKER = ".trash."
+
+
+def discard_dir(path: str) -> bool:
+    """
+    Rename the directory out of the way (one syscall) and delete it on a
+    background thread, so unlinking old datasets and checkpoints stays off
+    the job's critical path. Returns False if there was nothing to discard.
+    """
+    trash = f"{path}{TRASH_MARKER}{os.getpid()}.{time.time_ns()}"
+    try:
+        os.replace(path, trash)
+    except FileNotFoundError:
+        return False
+    threading.Thread(target=shutil.rmtree, args=(trash,), kwargs={"ignore_errors": True}, daemon=True).start()
+    return True
+
+
+def reap_trash_dirs() -> None:
+    """Remove trash left behind when a previous worker exited mid-delete."""
+    for root in (LOCAL_TRAIN_ROOT, OUTPUT_ROOT):
+        try:
+            with os.scandir(root) as it:
+                stale = [e.path for e in it if TRASH_MARKER in e.name and e.is_dir(follow_symlinks=False)]
+        except FileNotFoundError:
+            continue
+        for p in stale:
+            threading.Thread(target=shutil.rmtree, args=(p,), kwargs={"ignore_errors": True}, daemon=True).start()
+
+
 def cleanup_job_dirs(lora_id: Optional[str]) -> None:
     if not lora_id:
         return
@@ -453,8 +877,7 @@ def cleanup_job_dirs(lora_id: Optional[str]) -> None:
 
     for p in [train_dir, out_dir]:
         try:
-            if os.path.exists(p):
-                shutil.rmtree(p, ignore_errors=True)
+            if discard_dir(p):
                 log(f"🧹 Cleaned local dir: {p}")
         except Exception as e:
             log(f"⚠️ Cleanup failed for {p}: {e}")
@@ -533,8 +956,13 @@ def blip_caption(image_path: str) -> str:
 
 def write_caption(image_path: str, caption_text: str) -> None:
     root, _ = os.path.splitext(image_path)
-    with open(root + CAPTION_EXTENSION, "w", encoding="utf-8") as f:
-        f.write(caption_text)
+    data = memoryview(caption_text.encode("utf-8"))
+    fd = os.open(root + CAPTION_EXTENSION, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
 
 
 def build_caption(trigger_token: str, image_path: str) -> str:
@@ -565,11 +993,9 @@ def build_caption(trigger_token: str, image_path: str) -> str:
 # ─────────────────────────────────────────────────────────────
 # Dataset builder
 # ─────────────────────────────────────────────────────────────
-def prepare_dataset(lora_id: str, dataset_bucket: str, dataset_prefix: str) -> Dict[str, Any]:
-    s3 = make_r2_client()
-
+def prepare_dataset(s3, lora_id: str, dataset_bucket: str, dataset_prefix: str) -> Dict[str, Any]:
     base = os.path.join(LOCAL_TRAIN_ROOT, f"sf_{lora_id}")
-    shutil.rmtree(base, ignore_errors=True)
+    discard_dir(base)
     os.makedirs(base, exist_ok=True)
 
     bucket = _clean_optional_string(dataset_bucket)
@@ -579,21 +1005,23 @@ def prepare_dataset(lora_id: str, dataset_bucket: str, dataset_prefix: str) -> D
     if not prefix:
         raise RuntimeError("Missing dataset R2 prefix before training")
 
-    keys = r2_list_objects(s3, bucket, prefix)
+    keys = r2_list_objects(s3, bucket, prefix, max_images=MAX_IMAGES)
     if not keys:
         raise RuntimeError(f"No files found in R2 for this job: s3://{bucket}/{prefix}")
 
-    tmp = os.path.join(base, "_tmp")
-    os.makedirs(tmp, exist_ok=True)
-
+    # The listing already tells us which objects are images, so size the
+    # concept folder up front and download straight into it (no _tmp pass).
+    images: List[Tuple[str, str]] = []
+    seen: Dict[str, str] = {}
     for key in keys:
         filename = os.path.basename(key)
-        if not filename:
-            continue
-        local_path = os.path.join(tmp, filename)
-        r2_download_file(s3, bucket, key, local_path)
-
-    images = [f for f in os.listdir(tmp) if f.lower().endswith(IMAGE_EXTS)]
+        if filename and filename.lower().endswith(IMAGE_EXTS):
+            # Nested keys flatten into one folder; a repeated basename would
+            # silently overwrite an image and skew the count checked below.
+            if filename in seen:
+                raise RuntimeError(f"Duplicate image filename in dataset: {seen[filename]} and {key}")
+            seen[filename] = key
+            images.append((key, filename))
     count = len(images)
 
     if not (MIN_IMAGES <= count <= MAX_IMAGES):
@@ -606,18 +1034,25 @@ def prepare_dataset(lora_id: str, dataset_bucket: str, dataset_prefix: str) -> D
     concept_dir = os.path.join(base, f"{repeat}_{trigger_token}")
     os.makedirs(concept_dir, exist_ok=True)
 
-    # Write per-image captions
+    # boto3 clients are thread-safe; overlap the per-object round trips.
+    # Each image is captioned here as soon as it lands, so captioning (BLIP
+    # stays on this one thread) overlaps the downloads still in flight.
     captions_written = 0
-    for img in images:
-        src = os.path.join(tmp, img)
-        dst = os.path.join(concept_dir, img)
-        shutil.move(src, dst)
-
-        cap = build_caption(trigger_token, dst)
-        write_caption(dst, cap)
-        captions_written += 1
-
-    shutil.rmtree(tmp, ignore_errors=True)
+    with ThreadPoolExecutor(max_workers=DATASET_DOWNLOAD_WORKERS) as ex:
+        futures = {}
+        for key, filename in images:
+            dst = os.path.join(concept_dir, filename)
+            futures[ex.submit(r2_download_file, s3, bucket, key, dst)] = dst
+        try:
+            for fut in as_completed(futures):
+                fut.result()
+                dst = futures[fut]
+                write_caption(dst, build_caption(trigger_token, dst))
+                captions_written += 1
+        except Exception:
+            # Fail fast: don't keep pulling the rest of a dataset we'll discard.
+            ex.shutdown(wait=False, cancel_futures=True)
+            raise
 
     # Persist debug metadata
     meta = {
@@ -655,161 +1090,329 @@ def prepare_dataset(lora_id: str, dataset_bucket: str, dataset_prefix: str) -> D
 # ─────────────────────────────────────────────────────────────
 # Training
 # ─────────────────────────────────────────────────────────────
-def run_training(lora_id: str, ds: Dict[str, Any]) -> str:
+def prefetch_model_files() -> None:
+    """
+    Ask the kernel to start reading the base model and VAE into page cache
+    (async readahead). Called right before each launch so sd-scripts' own
+    startup overlaps the disk reads even if the previous job evicted them.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in (PRETRAINED_MODEL, VAE_PATH):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+@lru_cache(maxsize=None)
+def train_mixed_precision() -> str:
+    if MIXED_PRECISION != "auto":
+        return MIXED_PRECISION
+    try:
+        import torch  # type: ignore
+        if torch.cuda.is_available() and torch.cuda.get_device_capability() >= (8, 0):
+            return "bf16"
+    except Exception:
+        pass
+    return "fp16"
+
+
+# Job-independent part of the sd-scripts command line, built once.
+TRAIN_CMD_PREFIX: List[str] = [
+    PYTHON_BIN,
+    TRAIN_SCRIPT,
+    "--pretrained_model_name_or_path",
+    PRETRAINED_MODEL,
+    "--vae",
+    VAE_PATH,
+    "--caption_extension",
+    CAPTION_EXTENSION,
+    "--network_module",
+    NETWORK_MODULE,
+    "--resolution",
+    "1024,1024",
+    "--enable_bucket",
+    "--min_bucket_reso",
+    "512",
+    "--max_bucket_reso",
+    "1024",
+    "--bucket_reso_steps",
+    "64",
+    "--train_batch_size",
+    "1",
+    "--learning_rate",
+    "1e-4",
+    "--network_dim",
+    "64",
+    "--network_alpha",
+    "32",
+    "--sdpa",
+    "--gradient_checkpointing",
+    "--cache_latents",
+    "--save_model_as",
+    "safetensors",
+    "--save_every_n_steps",
+    "200",
+]
+
+
+def deprioritize_current_thread() -> None:
+    """
+    Linux applies nice and affinity per thread, so calling this on the pump
+    thread after Popen leaves sd-scripts (and the worker's main thread) alone.
+    """
+    try:
+        os.nice(PUMP_NICE)
+    except (AttributeError, OSError):
+        pass
+    if PIN_WORKER and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, {0})
+        except OSError:
+            pass
+
+
+def pump_output(pipe, sink, on_step=None, recent: Optional[deque] = None) -> None:
+    deprioritize_current_thread()
+    fd = pipe.fileno()
+    tail = b""
+    while True:
+        chunk = os.read(fd, 64 * 1024)
+        if not chunk:
+            break
+        sink.write(chunk)
+        sink.flush()
+
+        if recent is not None:
+            recent.append(chunk)
+
+        if on_step:
+            # Keep a short tail so a bar split across reads still matches.
+            window = tail + chunk
+            last = None
+            for last in TRAIN_STEP_RE.finditer(window):
+                pass
+            if last:
+                on_step(int(last.group(1)), int(last.group(2)))
+            tail = window[-256:]
+
+
+def output_tail(recent: deque, max_lines: int) -> str:
+    text = b"".join(recent).decode("utf-8", errors="replace")
+    lines = [ln.strip() for ln in re.split(r"[\r\n]+", text) if ln.strip()]
+    return "\n".join(lines[-max_lines:])
+
+
+def make_progress_reporter(lora_id: str):
+    last_pct = TRAIN_PROGRESS_START - 1
+    last_ts = 0.0
+    # PATCHes run off the pump thread so a slow Supabase never stalls the
+    # pipe drain (a full pipe would block sd-scripts itself).
+    in_flight = threading.Event()
+
+    def report(step: int, total: int) -> None:
+        nonlocal last_pct, last_ts
+        if total <= 0:
+            return
+        span = TRAIN_PROGRESS_END - TRAIN_PROGRESS_START
+        pct = TRAIN_PROGRESS_START + int(span * min(step, total) / total)
+        now = time.monotonic()
+        if pct <= last_pct or now - last_ts < PROGRESS_UPDATE_SECONDS:
+            return
+        if in_flight.is_set():
+            return  # previous PATCH still retrying; never queue behind it
+        last_pct, last_ts = pct, now
+        in_flight.set()
+        threading.Thread(target=send, args=(pct,), daemon=True).start()
+
+    def send(pct: int) -> None:
+        try:
+            # status filter: a late PATCH must not rewind a finished row.
+            sb_patch_safe("user_loras", {"progress": pct}, {"id": f"eq.{lora_id}", "status": "eq.training"})
+        except Exception as e:
+            log(f"⚠️ Progress update failed ({pct}%): {e}")
+        finally:
+            in_flight.clear()
+
+    return report
+
+
+def run_training(lora_id: str, ds: Dict[str, Any]) -> Tuple[str, int]:
     out = os.path.join(OUTPUT_ROOT, f"sf_{lora_id}")
     os.makedirs(out, exist_ok=True)
 
     name = f"sf_{lora_id}"
     artifact = os.path.join(out, f"{name}.safetensors")
 
-    cmd = [
-        PYTHON_BIN,
-        TRAIN_SCRIPT,
-        "--pretrained_model_name_or_path",
-        PRETRAINED_MODEL,
-        "--vae",
-        VAE_PATH,
+    cmd = TRAIN_CMD_PREFIX + [
         "--train_data_dir",
         ds["base_dir"],
-        "--caption_extension",
-        CAPTION_EXTENSION,
         "--output_dir",
         out,
         "--output_name",
         name,
-        "--network_module",
-        NETWORK_MODULE,
-        "--resolution",
-        "1024,1024",
-        "--enable_bucket",
-        "--min_bucket_reso",
-        "512",
-        "--max_bucket_reso",
-        "1024",
-        "--bucket_reso_steps",
-        "64",
-        "--train_batch_size",
-        "1",
-        "--learning_rate",
-        "1e-4",
         "--max_train_steps",
         str(ds["steps"]),
-        "--network_dim",
-        "64",
-        "--network_alpha",
-        "32",
         "--mixed_precision",
-        "fp16",
-        "--gradient_checkpointing",
-        "--save_model_as",
-        "safetensors",
-        "--save_every_n_steps",
-        "200",
+        train_mixed_precision(),
     ]
 
+    prefetch_model_files()
     log("🔥 Starting training")
     log("CMD: " + " ".join(cmd))
 
-    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0)
     if not p.stdout:
         raise RuntimeError("Training process failed to start")
 
-    for line in p.stdout:
-        print(line, end="")
+    # Forward raw bytes from a side thread; no per-line decode/print cost.
+    # The last few chunks are kept so a failure can report what sd-scripts said.
+    recent: deque = deque(maxlen=4)
+    pump = threading.Thread(
+        target=pump_output,
+        args=(p.stdout, sys.stdout.buffer, make_progress_reporter(lora_id), recent),
+        daemon=True,
+    )
+    pump.start()
 
-    if p.wait() != 0:
-        raise RuntimeError("Training failed")
+    started = time.monotonic()
+    while True:
+        try:
+            rc = p.wait(timeout=TRAIN_HEARTBEAT_SECONDS)
+            break
+        except subprocess.TimeoutExpired:
+            log(f"⏱️ Training {lora_id} still running ({int(time.monotonic() - started)}s)")
+    pump.join()
+    if rc != 0:
+        # The tail (tracebacks, pod paths, CUDA details) is for operators only;
+        # the exception text ends up in user_loras.error_message, which the app
+        # shows to the customer.
+        tail = output_tail(recent, TRAIN_ERROR_TAIL_LINES)
+        if tail:
+            log(f"❌ Training {lora_id} output tail:\n{tail}")
+        raise RuntimeError(f"Training failed (exit {rc})")
 
-    if not os.path.exists(artifact) or os.path.getsize(artifact) < ARTIFACT_MIN_BYTES:
+    try:
+        artifact_size = os.stat(artifact).st_size
+    except FileNotFoundError:
+        artifact_size = 0
+    if artifact_size < ARTIFACT_MIN_BYTES:
         raise RuntimeError("Invalid artifact produced")
 
     log(f"✅ Artifact created: {artifact}")
-    return artifact
+    return artifact, artifact_size
 
 
 # ─────────────────────────────────────────────────────────────
 # Worker loop
 # ─────────────────────────────────────────────────────────────
+def _finalize_completed(lora_id: str, uploaded_r2_key: str, ds: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Mark the row completed once the artifact is safe in R2. Tries the full
+    payload first and falls back to the minimal one the app needs.
+    """
+    minimal = {
+        "status": "completed",
+        "progress": 100,
+        "artifact_r2_bucket": R2_ARTIFACT_BUCKET,
+        "artifact_r2_key": uploaded_r2_key,
+    }
+    attempts = [minimal]
+    if ds:
+        attempts.insert(0, {
+            **minimal,
+            "dataset_r2_bucket": ds.get("r2_bucket"),
+            "dataset_r2_prefix": ds.get("r2_prefix"),
+            "image_count": ds.get("image_count"),
+            # Optional: store trigger_token if column exists; sb_patch_safe will strip if not.
+            "trigger_token": ds.get("trigger_token"),
+        })
+
+    for payload in attempts:
+        try:
+            sb_patch_safe(
+                "user_loras",
+                payload,
+                {"id": f"eq.{lora_id}"},
+                required=("status", "artifact_r2_key"),
+            )
+            return
+        except Exception as patch_err:
+            log(f"⚠️ Artifact is safe in R2 but Supabase update failed: {patch_err}")
+    log("⚠️ Minimal Supabase update also failed (artifact still safe)")
+
+
 def worker_main() -> None:
     sanity_checks()
+    reap_trash_dirs()
 
     log("🚀 LoRA worker started (PRODUCTION) — QUEUED ONLY + user_id NOT NULL")
     log(f"R2_DATASET_BUCKET={R2_DATASET_BUCKET}  R2_DATASET_PREFIX_ROOT={R2_DATASET_PREFIX_ROOT}")
     log(f"R2_ARTIFACT_BUCKET={R2_ARTIFACT_BUCKET}  R2_ARTIFACT_PREFIX_ROOT={R2_ARTIFACT_PREFIX_ROOT}")
     log(f"📝 Captioning: BLIP={USE_BLIP_CAPTIONS} model={BLIP_MODEL_ID if USE_BLIP_CAPTIONS else 'OFF'}")
+    log(f"🎛️ Mixed precision: {train_mixed_precision()} (LORA_MIXED_PRECISION={MIXED_PRECISION})")
+
+    # Load BLIP once up front so the first job doesn't pay the cold start
+    # (and a broken caption stack fails the worker, not a customer job).
+    if USE_BLIP_CAPTIONS:
+        _ensure_blip_loaded()
+
+    if USE_REALTIME:
+        threading.Thread(target=realtime_listen_forever, name="lora-realtime", daemon=True).start()
+    if DATABASE_URL:
+        threading.Thread(target=pg_listen_forever, name="lora-pg-listen", daemon=True).start()
+
+    # One R2 client for the worker's lifetime, shared by dataset download and
+    # artifact upload; boto3 reconnects on its own after long idle periods.
+    s3 = make_r2_client()
 
     last_idle = 0.0
+    idle_polls = 0
+    error_polls = 0
 
     while True:
+        job: Optional[Dict[str, Any]] = None
         lora_id: Optional[str] = None
         artifact_uploaded: bool = False
         uploaded_r2_key: Optional[str] = None
 
         try:
-            jobs = sb_get(
-                "user_loras",
-                {
-                    "select": "id,user_id,status,dataset_r2_bucket,dataset_r2_prefix",
-                    "status": "eq.queued",
-                    "user_id": "not.is.null",
-                    "order": "created_at.asc",
-                    "limit": 1,
-                },
-            )
+            JOB_WAKE.clear()
+            job = claim_next_job()
+            error_polls = 0
 
-            if not jobs:
+            if not job:
                 if time.time() - last_idle >= IDLE_LOG_SECONDS:
                     log("⏳ No queued jobs (with user_id) — waiting")
                     last_idle = time.time()
-                time.sleep(POLL_SECONDS)
+                wait_for_jobs(idle_polls)
+                idle_polls += 1
                 continue
 
-            raw_id = jobs[0].get("id")
+            idle_polls = 0
+
+            raw_id = job.get("id")
             log(f"📥 Raw job id repr: {repr(str(raw_id))}")
 
             lora_id = sanitize_uuid(raw_id, "user_loras.id")
-            log(f"📥 Picked queued job {lora_id}")
-
-            sb_patch_safe("user_loras", {"status": "training", "progress": 1}, {"id": f"eq.{lora_id}"})
+            log(f"📥 Claimed queued job {lora_id}")
 
-            dataset_bucket, dataset_prefix = resolve_dataset_source(lora_id, jobs[0])
-            ds = prepare_dataset(lora_id, dataset_bucket, dataset_prefix)
-            local_artifact = run_training(lora_id, ds)
+            dataset_bucket, dataset_prefix = resolve_dataset_source(lora_id, job)
+            ds = prepare_dataset(s3, lora_id, dataset_bucket, dataset_prefix)
+            local_artifact, artifact_size = run_training(lora_id, ds)
 
-            s3 = make_r2_client()
             uploaded_r2_key = f"{R2_ARTIFACT_PREFIX_ROOT}/{lora_id}/final.safetensors".replace("//", "/")
-            r2_upload_artifact(s3, local_artifact, R2_ARTIFACT_BUCKET, uploaded_r2_key)
+            r2_upload_artifact(s3, local_artifact, R2_ARTIFACT_BUCKET, uploaded_r2_key, size=artifact_size)
             artifact_uploaded = True
 
-            completed_payload = {
-                "status": "completed",
-                "progress": 100,
-                "artifact_r2_bucket": R2_ARTIFACT_BUCKET,
-                "artifact_r2_key": uploaded_r2_key,
-                "dataset_r2_bucket": ds.get("r2_bucket"),
-                "dataset_r2_prefix": ds.get("r2_prefix"),
-                "image_count": ds.get("image_count"),
-                # Optional: store trigger_token if column exists; sb_patch_safe will strip if not.
-                "trigger_token": ds.get("trigger_token"),
-            }
-
-            try:
-                sb_patch_safe("user_loras", completed_payload, {"id": f"eq.{lora_id}"})
-            except Exception as patch_err:
-                log(f"⚠️ Artifact is safe in R2 but Supabase update failed: {patch_err}")
-                try:
-                    sb_patch_safe(
-                        "user_loras",
-                        {
-                            "status": "completed",
-                            "progress": 100,
-                            "artifact_r2_bucket": R2_ARTIFACT_BUCKET,
-                            "artifact_r2_key": uploaded_r2_key,
-                        },
-                        {"id": f"eq.{lora_id}"},
-                    )
-                except Exception as patch_err_2:
-                    log(f"⚠️ Minimal Supabase update also failed (artifact still safe): {patch_err_2}")
+            _finalize_completed(lora_id, uploaded_r2_key, ds)
 
             notify_status(lora_id, "completed")
             log(f"✅ Completed job {lora_id}")
@@ -817,8 +1420,17 @@ def worker_main() -> None:
             cleanup_job_dirs(lora_id)
 
         except Exception as e:
+            if job is None:
+                # The claim itself failed: nothing to mark failed, just back off.
+                delay = claim_error_delay(e, error_polls)
+                error_polls += 1
+                log(f"⚠️ Job poll failed: {e} — retrying in {delay:.0f}s")
+                time.sleep(delay)
+                continue
+
             if artifact_uploaded and lora_id and uploaded_r2_key:
                 log(f"⚠️ Error AFTER artifact upload. Leaving as completed. Error: {e}")
+                _finalize_completed(lora_id, uploaded_r2_key)
                 cleanup_job_dirs(lora_id)
                 time.sleep(POLL_SECONDS)
                 continue
@@ -0,0 +1,17 @@
+-- Atomic LoRA trainer claim: one round trip, and concurrent workers skip rows another worker
+-- already holds instead of blocking on them and coming back empty.
+create or replace function public.claim_next_lora_job() returns setof public.user_loras
+language sql security invoker set search_path=pg_catalog,pg_temp as $$
+  update public.user_loras l
+     set status='training', progress=1, error_message=null
+   where l.id=(
+     select q.id from public.user_loras q
+      where q.status='queued' and q.user_id is not null
+      order by q.created_at, q.id
+      limit 1
+      for update skip locked
+   )
+  returning l.*;
+$$;
+revoke all on function public.claim_next_lora_job() from public,anon,authenticated;
+grant execute on function public.claim_next_lora_job() to service_role;
@@ -0,0 +1,15 @@
+-- Wake LoRA trainer workers that LISTEN on lora_queued as soon as a claimable row appears,
+-- instead of waiting for their next poll. The payload is the row id; workers still claim
+-- through claim_next_lora_job().
+create or replace function public.notify_lora_queued() returns trigger
+language plpgsql security invoker set search_path=pg_catalog,pg_temp as $$
+begin
+  perform pg_notify('lora_queued', new.id::text);
+  return null;
+end $$;
+revoke all on function public.notify_lora_queued() from public,anon,authenticated;
+
+create trigger user_loras_queued_notify
+after insert or update of status on public.user_loras
+for each row when (new.status='queued' and new.user_id is not null)
+execute function public.notify_lora_queued();